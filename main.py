@@ -1,46 +1,279 @@
 from typing import Annotated, List, Dict
 from datetime import datetime, time, timedelta
-from uuid import UUID
+from uuid import UUID, uuid4
+from contextlib import asynccontextmanager
+import hashlib
+import os
+import re
 
-from fastapi import FastAPI, Path, Query, Body, Cookie, Form, File, UploadFile, HTTPException
-from pydantic import BaseModel, Field
+import aiofiles
+import anyio.to_thread
+import msgspec
+import orjson
+from fastapi import FastAPI, Path, Query, Cookie, Form, File, UploadFile, HTTPException, Depends, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.coder import Coder
+from fastapi_cache.decorator import cache
+from redis import asyncio as aioredis
+from starlette.middleware.base import BaseHTTPMiddleware
 
-class Item(BaseModel):
+# Without REDIS_URL the response cache lives in process memory
+REDIS_URL = os.environ.get("REDIS_URL")
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "uploads")
+UPLOAD_CHUNK_SIZE = 1 << 20
+THREADPOOL_SIZE = 200
+
+# Structs are slotted by default. Those that only hold scalars or other gc=False structs can never
+# form reference cycles, so they also skip the GC header (16 bytes each) and collector tracking.
+class Item(msgspec.Struct, kw_only=True, gc=False):
     name: str
     description: str | None = None
     price: float
     tax: float | None = None
 
-class Offer(BaseModel):
+class Offer(msgspec.Struct):
     name: str
     discount: float
     items: List[Item]
 
-class User(BaseModel):
+class User(msgspec.Struct, gc=False):
     username: str
     email: str
     full_name: str | None
 
-class Author(BaseModel):
+class Author(msgspec.Struct, gc=False):
     name: str
     age: int
 
-class Book(BaseModel):
+class Book(msgspec.Struct, gc=False):
     title: str
     author: Author
     summary: str | None = None
 
-app = FastAPI()
+class CreateItemWithFields(msgspec.Struct, gc=False):
+    item: Item
+    importance: Annotated[int, msgspec.Meta(gt=0, description="The importance level of the item")]
+
+class UpdateItemResponse(msgspec.Struct, omit_defaults=True, gc=False):
+    item_id: int
+    item: Item
+    q: str | None = None
+
+class ExtraData(msgspec.Struct, gc=False):
+    start_time: Annotated[datetime, msgspec.Meta(
+        description="The start time of the item availability", extra_json_schema={"format": "date-time"}
+    )]
+    end_time: Annotated[time, msgspec.Meta(
+        description="The end time of the item availability", extra_json_schema={"format": "time"}
+    )]
+    repeat_every: Annotated[timedelta, msgspec.Meta(description="Interval at which the item should be repeated")]
+    process_id: Annotated[UUID, msgspec.Meta(description="Unique identifier for the process")]
+
+# msgspec only parses RFC 3339 / ISO 8601. These are the other shapes the pydantic baseline accepted for
+# ExtraData, rewritten into ones msgspec takes: no seconds ("10:00"), date-only, and "[D day[s], ]H:MM:SS"
+LEGACY_DATETIME = re.compile(r"(\d{4}-\d{2}-\d{2})(?:[T ](\d{2}:\d{2})(Z|[+-]\d{2}:\d{2})?)?")
+LEGACY_TIME = re.compile(r"(\d{2}:\d{2})(Z|[+-]\d{2}:\d{2})?")
+LEGACY_DURATION = re.compile(r"(?:(\d+) days?, )?(\d{1,2}):([0-5]\d):([0-5]\d(?:\.\d{1,6})?)")
+
+def legacy_extra_data(raw):
+    if not isinstance(raw, dict):
+        return raw
+    if isinstance(raw.get("start_time"), str) and (match := LEGACY_DATETIME.fullmatch(raw["start_time"])):
+        date, clock, tz = match.groups()
+        raw["start_time"] = f"{date}T{clock or '00:00'}:00{tz or ''}"
+    if isinstance(raw.get("end_time"), str) and (match := LEGACY_TIME.fullmatch(raw["end_time"])):
+        clock, tz = match.groups()
+        raw["end_time"] = f"{clock}:00{tz or ''}"
+    if isinstance(raw.get("repeat_every"), str) and (match := LEGACY_DURATION.fullmatch(raw["repeat_every"])):
+        days, hours, minutes, seconds = match.groups()
+        raw["repeat_every"] = int(days or 0) * 86400 + int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    return raw
+
+# Dependency that decodes and validates the raw request body as `model` in a single msgspec pass.
+# Non-strict decoding keeps pydantic's lax coercions such as "1" for an int field. If the typed decode fails
+# and `legacy` is given, the body is retried once through legacy(raw JSON) and msgspec.convert.
+def msgspec_body(model, legacy=None):
+    decoder = msgspec.json.Decoder(model, strict=False)
+
+    async def decode_body(request: Request):
+        body = await request.body()
+        try:
+            return decoder.decode(body)
+        except msgspec.DecodeError as exc:
+            error = exc
+        if legacy is not None:
+            try:
+                return msgspec.convert(legacy(msgspec.json.decode(body)), model, strict=False)
+            except msgspec.DecodeError as exc:
+                error = exc
+        raise RequestValidationError([{"type": "value_error", "loc": ("body",), "msg": str(error), "input": None}])
+
+    return decode_body
+
+# FastAPI can't see bodies read by msgspec_body, so routes declare them with openapi_extra=json_body(model).
+# The Struct schemas are generated by msgspec and merged into components.schemas by openapi() below.
+MSGSPEC_SCHEMAS = {}
+
+def json_body(model):
+    (schema,), components = msgspec.json.schema_components([model], ref_template="#/components/schemas/{name}")
+    MSGSPEC_SCHEMAS.update(components)
+    return {"requestBody": {"content": {"application/json": {"schema": schema}}, "required": True}}
+
+# Shared encoder for handlers that return Structs directly, skipping jsonable_encoder
+json_encoder = msgspec.json.Encoder()
+
+# Shared parameter declarations, built once and reused by every endpoint
+ItemId = Annotated[int, Path(ge=1, le=1000, description="The ID of the item (1-1000)")]
+SearchQ = Annotated[str | None, Query(min_length=3, max_length=50, description="Search query string")]
+SortOrder = Annotated[str, Query(pattern="^(asc|desc)$", description="Sort order: 'asc' or 'desc'")]
+
+# Cache-Control policy per GET route; these routes also get an ETag and answer If-None-Match with 304.
+# fastapi-cache2 sets its own W/<hash()> ETags and max-age=<ttl> on cached routes; hash() differs per worker,
+# so the middleware overwrites both and is the only layer clients get validators from
+CACHE_CONTROL = {
+    "/": "public, max-age=3600",
+    "/books/": "public, max-age=60",
+    "/items/{item_id}": "public, max-age=10, stale-while-revalidate=30",
+}
+# If-None-Match uses weak comparison (RFC 9110 §13.1.2): W/ prefixes are ignored and "*" matches anything
+def etag_matches(if_none_match, etag):
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in tags)
+
+# Innermost layer: tags the uncompressed body, since gzip output embeds its mtime and would change every second
+class ETagMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        start = None
+        passthrough = False
+        chunks = []
+
+        async def send_with_etag(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                if message["status"] != 200 or route is None or route.path not in CACHE_CONTROL:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+            if passthrough:
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+            # Build a new header list: prebuilt responses like HELLO share theirs across requests
+            headers = [(name, value) for name, value in start["headers"] if name != b"etag"]
+            headers.append((b"etag", etag.encode("latin-1")))
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_with_etag)
+
+class HTTPCacheMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if request.method != "GET" or route is None or route.path not in CACHE_CONTROL:
+            return response
+        if response.status_code == 304:
+            # Only fastapi-cache2 answers 304 downstream; keep its reply consistent with our policy
+            response.headers["Cache-Control"] = CACHE_CONTROL[route.path]
+            return response
+        if response.status_code != 200:
+            return response
+        response.headers["Cache-Control"] = CACHE_CONTROL[route.path]
+
+        etag = response.headers["ETag"]
+        if response.headers.get("Content-Encoding") == "gzip":
+            # The gzipped bytes are a different representation, so they need their own strong validator
+            etag = f'{etag[:-1]}-gzip"'
+            response.headers["ETag"] = etag
+        if etag_matches(request.headers.get("if-none-match", ""), etag):
+            headers = {"Cache-Control": CACHE_CONTROL[route.path], "ETag": etag}
+            # A 304 must repeat the validator-affecting headers of the 200 it stands in for
+            for name in ("Vary", "Content-Location"):
+                if name in response.headers:
+                    headers[name] = response.headers[name]
+            return Response(status_code=304, headers=headers)
+        return response
+
+# ORJSONResponse always passes OPT_NON_STR_KEYS | OPT_SERIALIZE_NUMPY. Every payload here has str keys and no
+# numpy arrays, and without OPT_NON_STR_KEYS orjson stays on its fast dict path (~2x on get_books' payload).
+class FastJSON(ORJSONResponse):
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+# Cached responses are stored as orjson bytes instead of going through the stdlib json encoder
+class ORJsonCoder(Coder):
+    @classmethod
+    def encode(cls, value):
+        return orjson.dumps(value)
+
+    @classmethod
+    def decode(cls, value):
+        return orjson.loads(value)
+
+# read_item results only depend on its own parameters, so key on exactly those
+def item_key_builder(func, namespace="", *, request=None, response=None, args=(), kwargs):
+    return f"{namespace}:{func.__name__}:{kwargs['item_id']}:{kwargs['q']!r}:{kwargs['sort_order']}"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Starlette's run_in_threadpool (and UploadFile's spooled file I/O) shares anyio's 40-token default
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    redis = aioredis.from_url(REDIS_URL) if REDIS_URL else None
+    backend = RedisBackend(redis) if redis is not None else InMemoryBackend()
+    FastAPICache.init(backend, prefix="sdc", coder=ORJsonCoder)
+    # Build the OpenAPI schema now so the first /docs or /openapi.json hit only reads app.openapi_schema
+    app.openapi()
+    yield
+    if redis is not None:
+        await redis.close()
+
+app = FastAPI(default_response_class=FastJSON, lifespan=lifespan)
+
+def openapi():
+    if app.openapi_schema is None:
+        schema = FastAPI.openapi(app)
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(MSGSPEC_SCHEMAS)
+    return app.openapi_schema
+
+app.openapi = openapi
+# Outermost first: HTTPCacheMiddleware -> GZip -> ETagMiddleware. GZip must see the route's single-message
+# body for minimum_size to apply, and the ETag is taken before compression
+app.add_middleware(ETagMiddleware)
+app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=5)
+app.add_middleware(HTTPCacheMiddleware)
+
+# Static payload, rendered once at import instead of on every request
+HELLO = Response(content=b'{"message":"Hello World"}', media_type="application/json")
 
 @app.get("/")
 async def root():
-    return {"message": "Hello World"}
+    return HELLO
 
 @app.get("/items/{item_id}")
+@cache(expire=30, key_builder=item_key_builder)
 async def read_item(
-    item_id: int = Path(..., ge=1, le=1000, description="The ID of the item (1-1000)"),
-    q: str | None = Query(None, min_length=3, max_length=50, description="Search query string"),
-    sort_order: str = Query("asc", pattern="^(asc|desc)$", description="Sort order: 'asc' or 'desc'"),
+    item_id: ItemId,
+    q: SearchQ = None,
+    sort_order: SortOrder = "asc",
 ):
     item = {
         "item_id": item_id,
@@ -49,67 +282,66 @@ async def read_item(
     }
     return item
 
-@app.put("/items/{item_id}")
+@app.put("/items/{item_id}", openapi_extra=json_body(Item))
 async def update_item(
-    item_id: int = Path(..., ge=1, le=1000, description="The ID of the item (1-1000)"),
-    item: Item = None,
-    q: str | None = Query(None, min_length=3, max_length=50, description="Search query string"),
+    item_id: ItemId,
+    item: Item = Depends(msgspec_body(Item)),
+    q: SearchQ = None,
 ):
-    result = {"item_id": item_id, **item.model_dump()}
-    if q:
-        result.update({"q": q})
-    return result
+    result = UpdateItemResponse(item_id=item_id, item=item, q=q)
+    return Response(content=json_encoder.encode(result), media_type="application/json")
 
 # New API for multiple query parameters handling
 @app.post("/items/filter/")
 async def filter_items(
+    request: Request,
     price_min: float = Query(0, description="Minimum price of the item"),
     price_max: float = Query(10000, description="Maximum price of the item"),
     tax_included: bool = Query(True, description="Whether the price includes tax or not"),
-    tags: List[str] = Query([], description="Tags to filter items"),
+    tags: str = Query("", description="Comma-separated tags to filter items; repeated keys are merged"),
 ):
+    # `tags` only holds the last tags= value, so split every one from the raw query; empty segments are dropped
     filtered_items = {
         "price_range": [price_min, price_max],
         "tax_included": tax_included,
-        "tags": tags,
+        "tags": [tag for value in request.query_params.getlist("tags") for tag in value.split(",") if tag],
         "message": "This is a filtered list of items based on the provided criteria.",
     }
     return filtered_items
 
 # New API for practicing usage of Body fields
-@app.post("/items/create_with_fields/")
+@app.post("/items/create_with_fields/", openapi_extra=json_body(CreateItemWithFields))
 async def create_item_with_fields(
-    item: Item = Body(...),
-    importance: int = Body(..., gt=0, description="The importance level of the item"),
+    payload: CreateItemWithFields = Depends(msgspec_body(CreateItemWithFields)),
 ):
-    return {"item": item, "importance": importance}
+    return {"item": msgspec.to_builtins(payload.item), "importance": payload.importance}
 
 
 # # New API for practicing nested models
-@app.post("/offers/")
-async def create_offer(offer: Offer):
-    return {"offer_name": offer.name, "discount": offer.discount, "items": offer.items}
+@app.post("/offers/", openapi_extra=json_body(Offer))
+async def create_offer(offer: Offer = Depends(msgspec_body(Offer))):
+    return {"offer_name": offer.name, "discount": offer.discount, "items": msgspec.to_builtins(offer.items)}
 
 # # New API with extra schema example
-@app.post("/users/")
-async def create_user(user: User):
+@app.post("/users/", openapi_extra=json_body(User))
+async def create_user(user: User = Depends(msgspec_body(User))):
     return {"username": user.username, "email": user.email, "full_name": user.full_name}
 
 # # New API for practicing extra data types
-@app.post("/items/extra_data_types/")
+@app.post("/items/extra_data_types/", openapi_extra=json_body(ExtraData))
 async def create_item_with_extra_data(
-    start_time: datetime = Body(..., description="The start time of the item availability"),
-    end_time: time = Body(..., description="The end time of the item availability"),
-    repeat_every: timedelta = Body(..., description="Interval at which the item should be repeated"),
-    process_id: UUID = Body(..., description="Unique identifier for the process"),
+    payload: ExtraData = Depends(msgspec_body(ExtraData, legacy=legacy_extra_data)),
 ):
-    return {
-        "start_time": start_time,
-        "end_time": end_time,
-        "repeat_every": repeat_every,
-        "process_id": process_id,
+    # ExtraData holds native datetime/time/UUID objects; hand them straight to orjson's C encoders instead of
+    # jsonable_encoder. orjson has no timedelta support and rejects tz-aware times, so those two are converted
+    # here exactly as jsonable_encoder did.
+    return FastJSON({
+        "start_time": payload.start_time,
+        "end_time": payload.end_time.isoformat(),
+        "repeat_every": payload.repeat_every.total_seconds(),
+        "process_id": payload.process_id,
         "message": "This is an item with extra data types."
-    }
+    })
 
 # # New API for practicing Cookie parameters
 @app.get("/items/cookies/")
@@ -134,6 +366,14 @@ async def create_item_with_form(
         "message": "This is an item created using form data."
     }
 
+# Uploads are stored under a server-generated name so clients can't escape UPLOAD_DIR or overwrite each other;
+# only a plain alphanumeric extension is kept from the client's filename
+def stored_upload_name(filename):
+    suffix = os.path.splitext(os.path.basename(filename))[1]
+    if not (suffix[1:].isascii() and suffix[1:].isalnum()):
+        suffix = ""
+    return f"{uuid4().hex}{suffix}"
+
 # Integrated API for practicing Form and File parameters
 @app.post("/items/form_and_file/")
 async def create_item_with_form_and_file(
@@ -147,6 +387,10 @@ async def create_item_with_form_and_file(
         raise HTTPException(status_code=400, detail="Price cannot be negative")
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file uploaded")
+    # Stream the upload to disk in chunks so large files never sit in memory or block the event loop
+    async with aiofiles.open(os.path.join(UPLOAD_DIR, stored_upload_name(file.filename)), "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await out.write(chunk)
     return {
         "name": name,
         "description": description,
@@ -157,19 +401,22 @@ async def create_item_with_form_and_file(
     }
 
 # New API for using lists instead of sets in response model
-@app.get("/books/", response_model=List[Book])
+# Sample books, converted to builtins once at import rather than on every request
+BOOKS = msgspec.to_builtins([
+    Book(title="Book 1", author=Author(name="Author 1", age=45), summary="A great book about..."),
+    Book(title="Book 2", author=Author(name="Author 2", age=38), summary="An interesting journey of..."),
+])
+
+@app.get("/books/", response_model=None)
 async def get_books():
-    return [
-        Book(title="Book 1", author=Author(name="Author 1", age=45), summary="A great book about..."),
-        Book(title="Book 2", author=Author(name="Author 2", age=38), summary="An interesting journey of..."),
-    ]
+    return BOOKS
 
 # New API for practicing extra models
-@app.post("/books/create_with_author/")
-async def create_book_with_author(book: Book):
-    return {"title": book.title, "author": book.author, "summary": book.summary}
+@app.post("/books/create_with_author/", openapi_extra=json_body(Book))
+async def create_book_with_author(book: Book = Depends(msgspec_body(Book))):
+    return {"title": book.title, "author": msgspec.to_builtins(book.author), "summary": book.summary}
 
 # New API for response status code
-@app.post("/books/", status_code=201)
-async def create_book(book: Book):
-    return {"title": book.title, "author": book.author, "summary": book.summary}
+@app.post("/books/", status_code=201, openapi_extra=json_body(Book))
+async def create_book(book: Book = Depends(msgspec_body(Book))):
+    return {"title": book.title, "author": msgspec.to_builtins(book.author), "summary": book.summary}
@@ -0,0 +1,333 @@
+import gzip
+import hashlib
+import pathlib
+import types
+
+import pytest
+from fastapi import FastAPI, Response
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+
+import main
+from main import app, ETagMiddleware, HTTPCacheMiddleware, ORJsonCoder
+
+JSON_BODY_ROUTES = [
+    ("put", "/items/{item_id}", "Item"),
+    ("post", "/items/create_with_fields/", "CreateItemWithFields"),
+    ("post", "/offers/", "Offer"),
+    ("post", "/users/", "User"),
+    ("post", "/items/extra_data_types/", "ExtraData"),
+    ("post", "/books/create_with_author/", "Book"),
+    ("post", "/books/", "Book"),
+]
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(main, "UPLOAD_DIR", str(tmp_path_factory.mktemp("uploads")))
+        with TestClient(app) as client:
+            # Swap the lifespan's Redis backend for an in-process one so tests don't need a server
+            FastAPICache.reset()
+            FastAPICache.init(InMemoryBackend(), prefix="sdc", coder=ORJsonCoder)
+            yield client
+
+
+@pytest.mark.parametrize("method, path, model", JSON_BODY_ROUTES)
+def test_openapi_documents_json_bodies(client, method, path, model):
+    schema = client.get("/openapi.json").json()
+    request_body = schema["paths"][path][method]["requestBody"]
+    assert request_body["required"] is True
+    assert request_body["content"]["application/json"]["schema"] == {"$ref": f"#/components/schemas/{model}"}
+    assert model in schema["components"]["schemas"]
+
+
+def test_body_errors_use_validation_error_shape(client):
+    response = client.put("/items/5", json={"name": "n", "price": "cheap"})
+    assert response.status_code == 422
+    (error,) = response.json()["detail"]
+    assert error["type"] == "value_error"
+    assert error["loc"] == ["body"]
+    assert "$.price" in error["msg"]
+
+
+def test_update_item_nests_the_item_and_echoes_q(client):
+    response = client.put("/items/5?q=hello", json={"name": "n", "price": 2, "tax": 0.5})
+    assert response.status_code == 200
+    assert response.json() == {
+        "item_id": 5, "item": {"name": "n", "description": None, "price": 2.0, "tax": 0.5}, "q": "hello"
+    }
+
+
+def test_update_item_omits_q_when_not_given(client):
+    response = client.put("/items/5", json={"name": "n", "price": 2})
+    assert response.status_code == 200
+    assert response.json() == {"item_id": 5, "item": {"name": "n", "description": None, "price": 2.0, "tax": None}}
+
+
+@pytest.mark.parametrize(
+    "query, tags",
+    [("", []), ("?tags=", []), ("?tags=a,b,c", ["a", "b", "c"]), ("?tags=a,,b,", ["a", "b"]),
+     ("?tags=a&tags=b,c", ["a", "b", "c"])],
+)
+def test_filter_items_tags_query(client, query, tags):
+    response = client.post(f"/items/filter/{query}")
+    assert response.status_code == 200
+    assert response.json()["tags"] == tags
+
+
+def test_malformed_json_body_is_a_validation_error(client):
+    response = client.post("/users/", content=b"{not json", headers={"Content-Type": "application/json"})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body"]
+
+
+def test_etag_route_answers_matching_if_none_match_with_304(client):
+    response = client.get("/")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    not_modified = client.get("/", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    assert not_modified.headers["cache-control"] == response.headers["cache-control"]
+
+
+@pytest.mark.parametrize("if_none_match", ["W/{etag}", '"other", {etag}', "*"])
+def test_if_none_match_uses_weak_comparison(client, if_none_match):
+    etag = client.get("/").headers["etag"]
+    not_modified = client.get("/", headers={"If-None-Match": if_none_match.format(etag=etag)})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["etag"] == etag
+
+
+def test_etag_route_mismatched_if_none_match_returns_200(client):
+    response = client.get("/", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+    assert response.json() == {"message": "Hello World"}
+    assert "etag" in response.headers
+
+
+def test_no_cache_control_on_non_200(client):
+    response = client.get("/items/0")
+    assert response.status_code == 422
+    assert "cache-control" not in response.headers
+    assert "etag" not in response.headers
+
+
+def test_304_keeps_vary_and_content_location():
+    cached_app = FastAPI()
+    cached_app.add_middleware(ETagMiddleware)
+    cached_app.add_middleware(HTTPCacheMiddleware)
+
+    @cached_app.get("/")
+    async def index():
+        return Response(b"hello", headers={"Vary": "Accept-Encoding", "Content-Location": "/index"})
+
+    cached_client = TestClient(cached_app)
+    etag = cached_client.get("/").headers["etag"]
+    not_modified = cached_client.get("/", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["vary"] == "Accept-Encoding"
+    assert not_modified.headers["content-location"] == "/index"
+
+
+def test_small_responses_are_not_gzipped(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert len(response.content) < 500
+    assert "content-encoding" not in response.headers
+    assert not response.headers["etag"].endswith('-gzip"')
+
+
+def test_gzipped_etag_is_stable_and_separate_from_identity(client, monkeypatch):
+    monkeypatch.setattr(main, "BOOKS", main.BOOKS * 20)
+    # Pin gzip's header mtime to two different seconds
+    monkeypatch.setattr(gzip, "time", types.SimpleNamespace(time=lambda: 1_700_000_000.0))
+    first = client.get("/books/", headers={"Accept-Encoding": "gzip"})
+    monkeypatch.setattr(gzip, "time", types.SimpleNamespace(time=lambda: 1_700_000_001.0))
+    second = client.get("/books/", headers={"Accept-Encoding": "gzip"})
+    assert first.headers["content-encoding"] == second.headers["content-encoding"] == "gzip"
+    assert first.headers["etag"] == second.headers["etag"]
+
+    identity = client.get("/books/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers
+    assert first.headers["etag"] == f'{identity.headers["etag"][:-1]}-gzip"'
+
+    not_modified = client.get("/books/", headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["etag"]})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["etag"] == first.headers["etag"]
+    assert not_modified.headers["vary"] == "Accept-Encoding"
+    # The identity validator doesn't revalidate the gzip variant
+    mismatched = client.get("/books/", headers={"Accept-Encoding": "gzip", "If-None-Match": identity.headers["etag"]})
+    assert mismatched.status_code == 200
+
+
+def test_read_item_etag_comes_from_the_middleware(client):
+    first = client.get("/items/7?q=hello")
+    second = client.get("/items/7?q=hello")
+    assert second.headers["x-fastapi-cache"] == "HIT"
+    expected = f'"{hashlib.blake2b(first.content, digest_size=16).hexdigest()}"'
+    for response in (first, second):
+        assert response.headers["etag"] == expected
+        assert response.headers["cache-control"] == "public, max-age=10, stale-while-revalidate=30"
+
+    not_modified = client.get("/items/7?q=hello", headers={"If-None-Match": expected})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["cache-control"] == "public, max-age=10, stale-while-revalidate=30"
+
+
+FORM_FIELDS = {"name": "n", "price": "2"}
+
+
+def uploaded_files():
+    return {path.name: path.read_bytes() for path in pathlib.Path(main.UPLOAD_DIR).iterdir()}
+
+
+@pytest.mark.parametrize("filename", ["..", ".", "../../etc/passwd", "a/../b.txt"])
+def test_upload_names_cannot_escape_upload_dir(client, filename):
+    before = uploaded_files()
+    response = client.post("/items/form_and_file/", data=FORM_FIELDS, files={"file": (filename, b"payload")})
+    assert response.status_code == 200
+    assert response.json()["filename"] == filename
+    (new_name,) = set(uploaded_files()) - set(before)
+    assert uploaded_files()[new_name] == b"payload"
+
+
+def test_upload_name_with_nul_byte(client):
+    # httpx percent-encodes NUL in filenames, so build the multipart body by hand
+    body = (
+        b'--sep\r\nContent-Disposition: form-data; name="name"\r\n\r\nn\r\n'
+        b'--sep\r\nContent-Disposition: form-data; name="price"\r\n\r\n2\r\n'
+        b'--sep\r\nContent-Disposition: form-data; name="file"; filename="f\x00.t\x00xt"\r\n\r\npayload\r\n'
+        b"--sep--\r\n"
+    )
+    response = client.post(
+        "/items/form_and_file/", content=body, headers={"Content-Type": "multipart/form-data; boundary=sep"}
+    )
+    assert response.status_code == 200
+
+
+def test_same_name_uploads_do_not_overwrite(client):
+    before = uploaded_files()
+    for content in (b"first", b"second"):
+        response = client.post("/items/form_and_file/", data=FORM_FIELDS, files={"file": ("same.txt", content)})
+        assert response.status_code == 200
+    new_files = {name: data for name, data in uploaded_files().items() if name not in before}
+    assert sorted(new_files.values()) == [b"first", b"second"]
+    assert all(name.endswith(".txt") for name in new_files)
+
+
+EXTRA_DATA = {
+    "start_time": "2024-01-01T10:00:00",
+    "end_time": "12:30:00",
+    "repeat_every": 3600,
+    "process_id": "12345678-1234-5678-1234-567812345678",
+}
+
+
+@pytest.mark.parametrize(
+    "field, value, expected",
+    [
+        ("start_time", "2024-01-01T10:00:00", "2024-01-01T10:00:00"),
+        ("start_time", "2024-01-01T10:00", "2024-01-01T10:00:00"),
+        ("start_time", "2024-01-01T10:00+05:00", "2024-01-01T10:00:00+05:00"),
+        ("start_time", "2024-01-01 10:00", "2024-01-01T10:00:00"),
+        ("start_time", "2024-01-01", "2024-01-01T00:00:00"),
+        ("end_time", "12:30:00", "12:30:00"),
+        ("end_time", "10:00", "10:00:00"),
+        ("end_time", "12:30:00Z", "12:30:00+00:00"),
+        ("end_time", "12:30+02:00", "12:30:00+02:00"),
+        ("repeat_every", 3600, 3600.0),
+        ("repeat_every", "P1D", 86400.0),
+        ("repeat_every", "01:00:00", 3600.0),
+        ("repeat_every", "1 day, 0:00:00", 86400.0),
+        ("repeat_every", "2 days, 1:00:00.5", 176400.5),
+    ],
+)
+def test_extra_data_accepts_pydantic_formats(client, field, value, expected):
+    response = client.post("/items/extra_data_types/", json={**EXTRA_DATA, field: value})
+    assert response.status_code == 200
+    assert response.json()[field] == expected
+
+
+@pytest.mark.parametrize("start_time", ["2024-01-01T10:00:00+00:00", "2024-01-01T10:00:00Z"])
+def test_utc_datetimes_are_encoded_with_z(client, start_time):
+    response = client.post("/items/extra_data_types/", json={**EXTRA_DATA, "start_time": start_time})
+    assert response.status_code == 200
+    assert response.json()["start_time"] == "2024-01-01T10:00:00Z"
+    assert b'"2024-01-01T10:00:00Z"' in response.content
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [("start_time", "soon"), ("start_time", "2024-13-01"), ("end_time", "25:00"), ("repeat_every", "bad"),
+     ("repeat_every", "1:75:00")],
+)
+def test_extra_data_rejects_invalid_values(client, field, value):
+    response = client.post("/items/extra_data_types/", json={**EXTRA_DATA, field: value})
+    assert response.status_code == 422
+    (error,) = response.json()["detail"]
+    assert error["loc"] == ["body"]
+    assert f"$.{field}" in error["msg"]
+
+
+def test_extra_data_schema_keeps_temporal_formats(client):
+    properties = client.get("/openapi.json").json()["components"]["schemas"]["ExtraData"]["properties"]
+    assert properties["start_time"] == {
+        "type": "string", "format": "date-time", "description": "The start time of the item availability"
+    }
+    assert properties["end_time"]["format"] == "time"
+    assert properties["repeat_every"]["format"] == "duration"
+    assert properties["process_id"]["format"] == "uuid"
+
+
+def collect_refs(node):
+    if isinstance(node, dict):
+        if "$ref" in node:
+            yield node["$ref"]
+        for value in node.values():
+            yield from collect_refs(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from collect_refs(value)
+
+
+def test_startup_openapi_matches_route_bodies(client):
+    # The lifespan builds the schema before the first request; it must include every declared body
+    assert app.openapi_schema is not None
+    schema = client.get("/openapi.json").json()
+    assert schema == app.openapi_schema
+
+    documented = {
+        (method.lower(), route.path): route.openapi_extra["requestBody"]
+        for route in app.routes
+        if isinstance(route, APIRoute) and route.openapi_extra
+        for method in route.methods
+    }
+    assert {(method, path) for method, path, _ in JSON_BODY_ROUTES} == set(documented)
+    for (method, path), request_body in documented.items():
+        assert schema["paths"][path][method]["requestBody"] == request_body
+
+    components = schema["components"]["schemas"]
+    for ref in collect_refs(schema):
+        assert ref.startswith("#/components/schemas/")
+        assert ref.removeprefix("#/components/schemas/") in components
+
+
+def test_lifespan_uses_in_memory_cache_without_redis_url(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "REDIS_URL", None)
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    FastAPICache.reset()
+    with TestClient(app):
+        assert isinstance(FastAPICache.get_backend(), InMemoryBackend)
+
+
+def test_get_books_serves_the_prebuilt_list_without_the_cache_backend(client):
+    response = client.get("/books/")
+    assert response.status_code == 200
+    assert response.json() == main.BOOKS
+    assert "x-fastapi-cache" not in response.headers
+    assert response.headers["cache-control"] == "public, max-age=60"